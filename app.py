@@ -7,6 +7,8 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import duckdb
+import pyarrow as pa
+import os
 from datetime import datetime, timedelta
 import numpy as np
 from insights_engine import build_insights, build_summary_insights, get_quick_stats
@@ -19,91 +21,293 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+MONTH_ORDER = [
+    "Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio",
+    "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"
+]
+
+# Mes como categórico ordenado: códigos enteros y orden calendario sin diccionarios
+MONTH_DTYPE = pd.CategoricalDtype(MONTH_ORDER, ordered=True)
+
+# Posición del mes (1-12) resuelta en DuckDB, sin mapear en Pandas
+MONTH_NUM_SQL = "list_position([" + ", ".join(f"'{m}'" for m in MONTH_ORDER) + "], month)"
+
+COUNTRY_KPI_SQL = "SELECT * FROM kpi_monthly WHERE month != 'Total'"
+
+# Consultas de productos (KPI o base); el orden y los filtros se agregan al usarlas
+PROD_KPI_SQL = """
+    SELECT *, make_date(year, month_num, 1) AS date
+    FROM kpi_prod_monthly
+    WHERE month != 'Total'
+"""
+PROD_BASE_SQL = f"""
+    SELECT 
+        year, month, month_num, category,
+        make_date(year, month_num, 1) AS date,
+        export, import, export - import AS balance
+    FROM (
+        SELECT 
+            year, month, {MONTH_NUM_SQL} AS month_num, category,
+            SUM(usd) FILTER (WHERE flow='export') AS export,
+            SUM(usd) FILTER (WHERE flow='import') AS import
+        FROM trade_prod 
+        WHERE month != 'Total'
+        GROUP BY year, month, category
+    )
+"""
+
+# Conexión de corta vida por carga: una conexión abierta durante toda la vida
+# de la app retendría el lock del archivo y haría fallar a los escritores del
+# pipeline (ETL/métricas); los resultados ya quedan en st.cache_data
+def get_con():
+    """Conexión DuckDB de solo lectura; usar con `with` para cerrarla al terminar"""
+    return duckdb.connect("trade.duckdb", read_only=True)
+
+def _existing_tables(con, *names):
+    """Tablas presentes entre `names`, vía catálogo (sin planificar consultas que fallen)"""
+    rows = con.execute(
+        "SELECT table_name FROM information_schema.tables WHERE list_contains(?, table_name)",
+        [list(names)]
+    ).fetchall()
+    return {name for (name,) in rows}
+
+def _arrow_types(arrow_type):
+    """Texto respaldado por Arrow (sin columnas object); el resto con el tipo por defecto"""
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.StringDtype("pyarrow")
+    return None
+
+def _fetch_df(con, query, params=None):
+    """Ejecutar consulta vía Arrow y pasar a Pandas liberando los buffers intermedios"""
+    result = con.execute(query, params) if params is not None else con.sql(query)
+    df = result.arrow().to_pandas(
+        split_blocks=True, self_destruct=True, date_as_object=False,
+        types_mapper=_arrow_types
+    )
+    if 'month' in df.columns:
+        df['month'] = df['month'].astype(MONTH_DTYPE)
+    if 'month_num' in df.columns:
+        df['month_num'] = df['month_num'].astype('int8')
+    return df
+
 # Cache para datos
 @st.cache_data(ttl=900)  # Cache por 15 minutos
 def load_data():
-    """Cargar datos desde DuckDB"""
+    """Cargar datos desde DuckDB (ya ordenados y con month_num/date)"""
     try:
-        con = duckdb.connect("trade.duckdb")
+        # Versión de datos: clave barata para los caches derivados
+        data_version = os.stat("trade.duckdb").st_mtime_ns
         
-        # Intentar cargar KPI si existe
-        try:
-            kpi_df = con.sql("SELECT * FROM kpi_monthly WHERE month != 'Total'").df()
-            has_kpi = True
-        except:
-            has_kpi = False
-            kpi_df = None
+        with get_con() as con:
+            tables = _existing_tables(con, 'kpi_monthly', 'trade_monthly')
+            
+            # Cargar KPI si existe
+            has_kpi = 'kpi_monthly' in tables
+            if has_kpi:
+                kpi_df = _fetch_df(con, f"""
+                    SELECT *, make_date(year, month_num, 1) AS date
+                    FROM ({COUNTRY_KPI_SQL})
+                    ORDER BY year, month_num
+                """)
+            else:
+                kpi_df = None
+            
+            # Datos base siempre disponibles: agregado materializado por el ETL,
+            # o calculado desde trade si la base es anterior a trade_monthly
+            if 'trade_monthly' in tables:
+                base_source = "SELECT * FROM trade_monthly"
+            else:
+                base_source = f"""
+                    SELECT 
+                        year, month, month_num,
+                        export, import, export - import AS balance
+                    FROM (
+                        SELECT 
+                            year, month, {MONTH_NUM_SQL} AS month_num,
+                            SUM(usd) FILTER (WHERE flow='export') AS export,
+                            SUM(usd) FILTER (WHERE flow='import') AS import
+                        FROM trade 
+                        WHERE month != 'Total'
+                        GROUP BY year, month
+                    )
+                """
+            if has_kpi:
+                # kpi_monthly ya trae las columnas base: sin una segunda lectura
+                base_df = kpi_df[['year', 'month', 'month_num', 'export', 'import', 'balance', 'date']]
+            else:
+                base_df = _fetch_df(con, f"""
+                    SELECT *, make_date(year, month_num, 1) AS date
+                    FROM ({base_source})
+                    ORDER BY year, month_num
+                """)
         
-        # Datos base siempre disponibles
-        base_df = con.sql("""
-            SELECT 
-                year, month,
-                SUM(CASE WHEN flow='export' THEN usd END) as export,
-                SUM(CASE WHEN flow='import' THEN usd END) as import,
-                SUM(CASE WHEN flow='export' THEN usd END) - 
-                SUM(CASE WHEN flow='import' THEN usd END) as balance
-            FROM trade 
-            WHERE month != 'Total'
-            GROUP BY year, month
-            ORDER BY year, month
-        """).df()
+        # Clave de los caches derivados: consulta de origen activa + versión
+        data_key = (COUNTRY_KPI_SQL if has_kpi else base_source, data_version)
         
-        con.close()
-        return base_df, kpi_df, has_kpi
+        # Metadatos fijos por carga: límites del slider y totales anuales para el YTD
+        active_df = kpi_df if has_kpi else base_df
+        meta = {
+            'min_year': int(active_df['year'].min()),
+            'max_year': int(active_df['year'].max()),
+            'yearly_totals': active_df.groupby('year')[['export', 'import']].sum(),
+        }
+        return base_df, kpi_df, has_kpi, data_key, meta
         
     except Exception as e:
         st.error(f"Error cargando datos: {e}")
-        return None, None, False
+        return None, None, False, None, None
 
 @st.cache_data(ttl=900)
 def load_products_data():
     """Cargar datos de productos por categoría"""
     try:
-        con = duckdb.connect("trade.duckdb")
-        
-        # Intentar cargar KPI de productos
-        try:
-            kpi_prod_df = con.sql("SELECT * FROM kpi_prod_monthly WHERE month != 'Total'").df()
-            has_prod_kpi = True
-        except:
-            has_prod_kpi = False
-            kpi_prod_df = None
+        with get_con() as con:
+            tables = _existing_tables(con, 'trade_prod', 'kpi_prod_monthly')
+            
+            # Cargar KPI de productos si existe
+            has_prod_kpi = 'kpi_prod_monthly' in tables
+            if has_prod_kpi:
+                kpi_prod_df = _fetch_df(con, f"{PROD_KPI_SQL} ORDER BY year, month_num, category")
+            else:
+                kpi_prod_df = None
+            
+            # Datos base de productos: solo se agregan desde trade_prod si no hay KPI,
+            # que es lo que consumen todas las vistas cuando existe
+            has_prod = 'trade_prod' in tables
+            if has_prod and not has_prod_kpi:
+                prod_df = _fetch_df(con, f"{PROD_BASE_SQL} ORDER BY year, month_num, category")
+            else:
+                prod_df = None
         
-        # Datos base de productos
-        try:
-            prod_df = con.sql("""
-                SELECT 
-                    year, month, category,
-                    SUM(CASE WHEN flow='export' THEN usd END) as export,
-                    SUM(CASE WHEN flow='import' THEN usd END) as import,
-                    SUM(CASE WHEN flow='export' THEN usd END) - 
-                    SUM(CASE WHEN flow='import' THEN usd END) as balance
-                FROM trade_prod 
-                WHERE month != 'Total'
-                GROUP BY year, month, category
-                ORDER BY year, month, category
-            """).df()
-            has_prod = True
-        except:
-            has_prod = False
-            prod_df = None
+        # Resumen precalculado para los controles del sidebar
+        active_df = kpi_prod_df if has_prod_kpi else prod_df
+        summary = summarize_products(active_df) if active_df is not None else None
         
-        con.close()
-        return prod_df, kpi_prod_df, has_prod, has_prod_kpi
+        return prod_df, kpi_prod_df, has_prod, has_prod_kpi, summary
         
     except Exception as e:
-        return None, None, False, False
+        return None, None, False, False, None
+
+@st.cache_data(ttl=900)
+def load_products_slice(year_range, categories, use_kpi):
+    """Cargar solo el rango de años y las categorías seleccionadas (filtro en DuckDB)"""
+    source = PROD_KPI_SQL if use_kpi else PROD_BASE_SQL
+    placeholders = ", ".join("?" * len(categories))
+    with get_con() as con:
+        df = _fetch_df(con, f"""
+            SELECT * FROM ({source})
+            WHERE year BETWEEN ? AND ? AND category IN ({placeholders})
+            ORDER BY year, month_num, category
+        """, [*year_range, *categories])
+    return df
+
+def summarize_products(df, max_top=50):
+    """Años, categorías y ranking exportador por año (hasta max_top por año)"""
+    exp_col = 'exp' if 'exp' in df.columns else 'export'
+    yearly = (df.groupby(['year', 'category'], observed=True, sort=False)[exp_col]
+                .sum()
+                .reset_index()
+                .sort_values(['year', exp_col], ascending=[True, False]))
+    top_by_year = yearly.groupby('year', sort=False).head(max_top).groupby('year', sort=False)['category'].agg(list)
+    return {
+        'min_year': int(df['year'].min()),
+        'max_year': int(df['year'].max()),
+        'categories': sorted(df['category'].unique().tolist()),
+        'top_export_by_year': {int(y): cats for y, cats in top_by_year.items()},
+    }
 
 def format_currency(value, suffix=""):
     """Formatear moneda en millones o billones"""
-    if pd.isna(value):
-        return "N/A"
-    if abs(value) >= 1e9:
-        return f"${value/1e9:.1f}B{suffix}"
-    elif abs(value) >= 1e6:
-        return f"${value/1e6:.0f}M{suffix}"
+    return format_currency_array([value], suffix)[0]
+
+def format_currency_array(values, suffix=""):
+    """Formatear moneda en millones o billones para un arreglo completo"""
+    values = np.asarray(values, dtype='float64')
+    abs_v = np.abs(values)
+    is_b = abs_v >= 1e9
+    is_m = (abs_v >= 1e6) & ~is_b
+    is_small = ~(is_b | is_m) & ~np.isnan(values)
+    
+    out = np.full(values.shape, "N/A", dtype=object)
+    tail = suffix.replace('%', '%%')
+    out[is_b] = np.char.mod('$%.1fB' + tail, values[is_b] / 1e9)
+    out[is_m] = np.char.mod('$%.0fM' + tail, values[is_m] / 1e6)
+    # El separador de miles no existe en el formato '%', solo en format()
+    out[is_small] = [f"${v:,.0f}{suffix}" for v in values[is_small]]
+    return out.tolist()
+
+# Derivados memoizados por data_key (consulta de origen + versión) y estado del
+# slider. El DataFrame va con prefijo "_" para que Streamlit no lo hashee.
+@st.cache_data(ttl=900)
+def _filter_years(_df, data_key, year_range):
+    """Filas dentro del rango de años"""
+    return _df[_df['year'].between(*year_range)]
+
+def _compute_ytd(yearly_totals, year_range):
+    """Totales del último año del rango y variación vs. el año previo (sin consultar DuckDB)"""
+    totals = yearly_totals.loc[year_range[0]:year_range[1]]
+    
+    if totals.empty:
+        return 0, 0, 0, 0
+    
+    current_year = totals.index[-1]
+    export_ytd, import_ytd = totals.iloc[-1]
+    
+    # Comparar con año anterior
+    if len(totals) > 1 and totals.index[-2] == current_year - 1:
+        export_prev, import_prev = totals.iloc[-2]
+        export_change = (export_ytd / export_prev - 1) * 100 if export_prev > 0 else 0
+        import_change = (import_ytd / import_prev - 1) * 100 if import_prev > 0 else 0
     else:
-        return f"${value:,.0f}{suffix}"
+        export_change = import_change = 0
+    
+    return export_ytd, import_ytd, export_change, import_change
+
+@st.cache_data(ttl=900)
+def _compute_month_pivot(_df, data_key, year_range):
+    """Matriz mes × año de exportaciones para el heatmap"""
+    filtered_df = _filter_years(_df, data_key, year_range)
+    
+    # Una fila por (año, mes): basta ubicar cada valor en la grilla 12 × años,
+    # sin pasar por pivot_table. Los meses faltantes del año en curso quedan NaN.
+    year_values = filtered_df['year'].to_numpy()
+    years = np.unique(year_values)
+    heat_values = np.full((12, len(years)), np.nan)
+    heat_values[
+        filtered_df['month_num'].to_numpy() - 1,
+        np.searchsorted(years, year_values)
+    ] = filtered_df['export'].to_numpy()
+    return heat_values, years.tolist(), MONTH_ORDER
+
+@st.cache_data(ttl=900)
+def _compute_month_stats(data_key, year_range):
+    """Promedio y desviación de exportaciones por mes, en orden calendario (en DuckDB)"""
+    source, _ = data_key
+    with get_con() as con:
+        month_stats = _fetch_df(con, f"""
+            SELECT month, AVG(export) AS mean, STDDEV_SAMP(export) AS std
+            FROM ({source})
+            WHERE year BETWEEN ? AND ?
+            GROUP BY month_num, month
+            ORDER BY month_num
+        """, list(year_range))
+    return month_stats
+
+# Insights memoizados: insights_engine queda libre de Streamlit y aquí se
+# cachea por data_key + filtros (los DataFrames no se hashean).
+@st.cache_data(ttl=900)
+def _cached_summary_insights(_base_df, _df, data_key, use_kpi):
+    """Resumen ejecutivo país vs. productos"""
+    return build_summary_insights(_base_df, _df)
+
+@st.cache_data(ttl=900)
+def _cached_category_insights(_df, data_key, use_kpi, year_range, categories):
+    """Insights y estadísticas rápidas del rango de años y categorías; None si no hay filas"""
+    mask = _df['year'].between(*year_range) & _df['category'].isin(categories)
+    subset = _df.loc[mask]  # solo lectura: sin copia
+    if subset.empty:
+        return None
+    return build_insights(subset, top_n=3), get_quick_stats(subset)
 
 def main():
     """Dashboard principal"""
@@ -113,10 +317,10 @@ def main():
     st.markdown("*Análisis en tiempo real de importaciones y exportaciones*")
     
     # Cargar datos generales
-    base_df, kpi_df, has_kpi = load_data()
+    base_df, kpi_df, has_kpi, data_key, meta = load_data()
     
     # Cargar datos de productos
-    prod_df, kpi_prod_df, has_prod, has_prod_kpi = load_products_data()
+    prod_df, kpi_prod_df, has_prod, has_prod_kpi, prod_summary = load_products_data()
     
     if base_df is None:
         st.error("❌ No se pudieron cargar los datos. Ejecuta primero `uv run python observatorio/etl.py`")
@@ -126,33 +330,26 @@ def main():
     tab1, tab2, tab3 = st.tabs(["🇵🇪 Análisis por País", "🏷️ Análisis por Categorías", "🚀 Conclusiones"])
     
     with tab1:
-        render_country_analysis(base_df, kpi_df, has_kpi)
+        render_country_analysis(base_df, kpi_df, has_kpi, data_key, meta)
     
     with tab2:
         if has_prod:
-            render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi)
+            render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi, prod_summary)
         else:
             st.warning("❌ No hay datos de productos disponibles.")
             st.info("💡 Ejecuta: `uv run python observatorio/etl_products.py` para generar datos por categorías")
     
     with tab3:
-        render_insights_analysis(base_df, prod_df, kpi_df, kpi_prod_df, has_kpi, has_prod, has_prod_kpi)
+        render_insights_analysis(base_df, prod_df, kpi_df, kpi_prod_df, has_kpi, has_prod, has_prod_kpi, data_key)
 
-def render_country_analysis(base_df, kpi_df, has_kpi):
+def render_country_analysis(base_df, kpi_df, has_kpi, data_key, meta):
     """Renderizar análisis por país (datos agregados nacionales)"""
     
-    # Usar KPI si está disponible, sino base
+    # Usar KPI si está disponible, sino base (ya ordenado y con fecha desde DuckDB)
     df = kpi_df if has_kpi else base_df
     
-    # Preparar datos temporales
-    month_order = [
-        "Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio",
-        "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"
-    ]
-    
-    df['month_num'] = df['month'].map({m: i+1 for i, m in enumerate(month_order)})
-    df = df.sort_values(['year', 'month_num']).reset_index(drop=True)
-    df['date'] = pd.to_datetime(df['year'].astype(str) + '-' + df['month_num'].astype(str), format='%Y-%m')
+    # Columnas de flujo presentes: fijas por carga, se consultan una sola vez
+    avail = set(df.columns.intersection(['export', 'import', 'balance']))
     
     # ==============================================
     # SIDEBAR - CONTROLES POR PAÍS
@@ -160,8 +357,8 @@ def render_country_analysis(base_df, kpi_df, has_kpi):
     
     st.sidebar.header("🇵🇪 Configuración País")
     
-    # Filtro de años
-    min_year, max_year = int(df['year'].min()), int(df['year'].max())
+    # Filtro de años (límites precalculados en la carga)
+    min_year, max_year = meta['min_year'], meta['max_year']
     year_range = st.sidebar.slider(
         "Rango de años",
         min_value=min_year,
@@ -183,9 +380,8 @@ def render_country_analysis(base_df, kpi_df, has_kpi):
         key="country_view_type"
     )
     
-    # Filtrar datos
-    mask = df['year'].between(*year_range)
-    filtered_df = df[mask].copy()
+    # Filtrar datos (memoizado: cambiar checkboxes no vuelve a filtrar)
+    filtered_df = _filter_years(df, data_key, year_range)
     
     # ==============================================
     # MÉTRICAS PRINCIPALES
@@ -194,26 +390,8 @@ def render_country_analysis(base_df, kpi_df, has_kpi):
     st.header("📊 Métricas Clave")
     
     # Calcular métricas YTD para el último año disponible
-    current_year = filtered_df['year'].max()
-    ytd_data = filtered_df[filtered_df['year'] == current_year]
-    
-    if len(ytd_data) > 0:
-        export_ytd = ytd_data['export'].sum() if 'export' in ytd_data.columns else 0
-        import_ytd = ytd_data['import'].sum() if 'import' in ytd_data.columns else 0
-        balance_ytd = export_ytd - import_ytd
-        
-        # Comparar con año anterior
-        prev_year_data = filtered_df[filtered_df['year'] == current_year - 1]
-        if len(prev_year_data) > 0:
-            export_prev = prev_year_data['export'].sum()
-            import_prev = prev_year_data['import'].sum()
-            export_change = (export_ytd / export_prev - 1) * 100 if export_prev > 0 else 0
-            import_change = (import_ytd / import_prev - 1) * 100 if import_prev > 0 else 0
-        else:
-            export_change = import_change = 0
-    else:
-        export_ytd = import_ytd = balance_ytd = 0
-        export_change = import_change = 0
+    export_ytd, import_ytd, export_change, import_change = _compute_ytd(meta['yearly_totals'], year_range)
+    balance_ytd = export_ytd - import_ytd
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -253,51 +431,24 @@ def render_country_analysis(base_df, kpi_df, has_kpi):
     
     st.header("📈 Serie Temporal")
     
-    fig = go.Figure()
-    
-    if show_exports and 'export' in filtered_df.columns:
-        y_values = filtered_df['export'] / 1e9
-        fig.add_trace(go.Scatter(
-            x=filtered_df['date'],
-            y=y_values,
-            name='Exportaciones',
-            line=dict(color='#2E8B57', width=2),
-            hovertemplate='<b>Exportaciones</b><br>%{x}<br>$%{y:.1f}B USD<extra></extra>'
-        ))
+    # Series seleccionadas en miles de millones, graficadas con el line_chart nativo
+    # (Vega-Lite): sin serializar figuras Plotly ni cargar plotly.js en el primer render
+    series = [
+        ('export', 'Exportaciones', '#2E8B57', show_exports),
+        ('import', 'Importaciones', '#DC143C', show_imports),
+        ('balance', 'Balance', '#4169E1', show_balance),
+    ]
+    series = [s for s in series if s[3] and s[0] in avail]
     
-    if show_imports and 'import' in filtered_df.columns:
-        y_values = filtered_df['import'] / 1e9
-        fig.add_trace(go.Scatter(
-            x=filtered_df['date'],
-            y=y_values,
-            name='Importaciones',
-            line=dict(color='#DC143C', width=2),
-            hovertemplate='<b>Importaciones</b><br>%{x}<br>$%{y:.1f}B USD<extra></extra>'
-        ))
+    st.caption(f"Comercio Exterior del Perú ({year_range[0]}-{year_range[1]}) · Miles de Millones USD")
     
-    if show_balance and 'balance' in filtered_df.columns:
-        y_values = filtered_df['balance'] / 1e9
-        fig.add_trace(go.Scatter(
-            x=filtered_df['date'],
-            y=y_values,
-            name='Balance',
-            line=dict(color='#4169E1', width=2),
-            hovertemplate='<b>Balance</b><br>%{x}<br>$%{y:.1f}B USD<extra></extra>'
-        ))
-        
-        # Línea de referencia en cero
-        fig.add_hline(y=0, line_dash="dash", line_color="gray", opacity=0.5)
-    
-    fig.update_layout(
-        title=f"Comercio Exterior del Perú ({year_range[0]}-{year_range[1]})",
-        xaxis_title="Año",
-        yaxis_title="Miles de Millones USD",
-        template="plotly_white",
-        hovermode="x unified",
-        height=500
-    )
-    
-    st.plotly_chart(fig, use_container_width=True)
+    if series:
+        chart_df = pd.DataFrame(
+            filtered_df[[col for col, *_ in series]].to_numpy(dtype=np.float32) / 1e9,
+            index=filtered_df['date'],
+            columns=[name for _, name, *_ in series]
+        )
+        st.line_chart(chart_df, color=[color for _, _, color, _ in series], height=500)
     
     # ==============================================
     # ANÁLISIS ADICIONALES
@@ -310,17 +461,12 @@ def render_country_analysis(base_df, kpi_df, has_kpi):
         
         # Heatmap por año y mes
         if len(filtered_df) > 12:
-            pivot_data = filtered_df.pivot_table(
-                index='month',
-                columns='year', 
-                values='export',
-                aggfunc='mean'
-            )
+            heat_values, heat_years, heat_months = _compute_month_pivot(df, data_key, year_range)
             
             fig_heat = px.imshow(
-                pivot_data.values,
-                x=pivot_data.columns,
-                y=pivot_data.index,
+                heat_values,
+                x=heat_years,
+                y=heat_months,
                 aspect='auto',
                 color_continuous_scale='RdYlGn',
                 title="Exportaciones por Año y Mes"
@@ -333,9 +479,7 @@ def render_country_analysis(base_df, kpi_df, has_kpi):
         st.subheader("📊 Distribución Mensual")
         
         # Box plot por mes
-        month_stats = filtered_df.groupby('month')['export'].agg(['mean', 'std']).reset_index()
-        month_stats['month_num'] = month_stats['month'].map({m: i+1 for i, m in enumerate(month_order)})
-        month_stats = month_stats.sort_values('month_num')
+        month_stats = _compute_month_stats(data_key, year_range)
         
         fig_box = go.Figure()
         fig_box.add_trace(go.Bar(
@@ -362,18 +506,23 @@ def render_country_analysis(base_df, kpi_df, has_kpi):
     
     st.header("📋 Datos Detallados")
     
-    # Preparar tabla
-    display_df = filtered_df[['year', 'month', 'export', 'import', 'balance']].copy()
-    display_df['export'] = display_df['export'].apply(lambda x: format_currency(x))
-    display_df['import'] = display_df['import'].apply(lambda x: format_currency(x))
-    display_df['balance'] = display_df['balance'].apply(lambda x: format_currency(x))
-    
-    # Renombrar columnas
-    display_df.columns = ['Año', 'Mes', 'Exportaciones', 'Importaciones', 'Balance']
+    # Últimos 2 años en miles de millones; el formato lo aplica el navegador
+    display_df = filtered_df[['year', 'month', 'export', 'import', 'balance']].tail(24)
+    display_df = display_df.assign(**{
+        col: display_df[col] / 1e9
+        for col in ['export', 'import', 'balance']
+    })
     
     # Mostrar tabla con paginación
     st.dataframe(
-        display_df.tail(24),  # Últimos 2 años
+        display_df,
+        column_config={
+            'year': st.column_config.NumberColumn('Año', format='%d'),
+            'month': st.column_config.TextColumn('Mes'),
+            'export': st.column_config.NumberColumn('Exportaciones', format='$%.2fB'),
+            'import': st.column_config.NumberColumn('Importaciones', format='$%.2fB'),
+            'balance': st.column_config.NumberColumn('Balance', format='$%.2fB'),
+        },
         use_container_width=True,
         height=400
     )
@@ -397,22 +546,12 @@ def render_country_analysis(base_df, kpi_df, has_kpi):
         else:
             st.caption("⚠️ Datos base (ejecutar metrics.py para KPIs)")
 
-def render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi):
+def render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi, summary):
     """Renderizar análisis por categorías de productos"""
     
-    # Usar KPI de productos si está disponible, sino base
+    # Usar KPI de productos si está disponible, sino base (ya ordenado y con fecha desde DuckDB)
     df = kpi_prod_df if has_prod_kpi else prod_df
     
-    # Preparar datos temporales
-    month_order = [
-        "Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio",
-        "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"
-    ]
-    
-    df['month_num'] = df['month'].map({m: i+1 for i, m in enumerate(month_order)})
-    df = df.sort_values(['year', 'month_num', 'category']).reset_index(drop=True)
-    df['date'] = pd.to_datetime(df['year'].astype(str) + '-' + df['month_num'].astype(str), format='%Y-%m')
-    
     # ==============================================
     # SIDEBAR - CONTROLES DE CATEGORÍAS
     # ==============================================
@@ -420,7 +559,7 @@ def render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi):
     st.sidebar.header("🏷️ Filtros de Categorías")
     
     # Filtro de años para categorías
-    min_year, max_year = int(df['year'].min()), int(df['year'].max())
+    min_year, max_year = summary['min_year'], summary['max_year']
     year_range_cat = st.sidebar.slider(
         "Rango de años (categorías)",
         min_value=min_year,
@@ -431,7 +570,7 @@ def render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi):
     )
     
     # Filtro de categorías
-    all_categories = sorted(df['category'].unique())
+    all_categories = summary['categories']
     
     # Selector de top categorías
     n_top = st.sidebar.number_input(
@@ -443,20 +582,8 @@ def render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi):
         key="n_top_categories"
     )
     
-    # Obtener top categorías por exportación del último año
-    last_year_data = df[df['year'] == df['year'].max()]
-    if 'exp' in df.columns:
-        top_categories = (last_year_data.groupby('category')['exp']
-                         .sum()
-                         .sort_values(ascending=False)
-                         .head(n_top)
-                         .index.tolist())
-    else:
-        top_categories = (last_year_data.groupby('category')['export']
-                         .sum()
-                         .sort_values(ascending=False)
-                         .head(n_top)
-                         .index.tolist())
+    # Obtener top categorías por exportación del último año (precalculado)
+    top_categories = summary['top_export_by_year'][max_year][:n_top]
     
     # Selector manual de categorías
     manual_mode = st.sidebar.checkbox("Selección manual de categorías", key="manual_categories")
@@ -479,9 +606,11 @@ def render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi):
         key="category_analysis_type"
     )
     
-    # Filtrar datos
-    mask = (df['year'].between(*year_range_cat)) & (df['category'].isin(selected_categories))
-    filtered_df = df[mask].copy()
+    # Filtrar datos en DuckDB (cache por años + tupla de categorías)
+    if selected_categories:
+        filtered_df = load_products_slice(tuple(year_range_cat), tuple(selected_categories), has_prod_kpi)
+    else:
+        filtered_df = df.iloc[0:0]
     
     if filtered_df.empty:
         st.warning("❌ No hay datos para los filtros seleccionados")
@@ -497,13 +626,14 @@ def render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi):
     current_year = filtered_df['year'].max()
     ytd_data = filtered_df[filtered_df['year'] == current_year]
     
+    # Nombres de columnas de flujo (KPI: exp/imp; base: export/import), resueltos una vez
+    if 'exp' in filtered_df.columns and 'imp' in filtered_df.columns:
+        exp_col, imp_col = 'exp', 'imp'
+    else:
+        exp_col, imp_col = 'export', 'import'
+    
     if len(ytd_data) > 0:
-        if 'exp' in filtered_df.columns and 'imp' in filtered_df.columns:
-            exp_col, imp_col = 'exp', 'imp'
-        else:
-            exp_col, imp_col = 'export', 'import'
-        
-        cat_metrics = ytd_data.groupby('category').agg({
+        cat_metrics = ytd_data.groupby('category', observed=True, sort=False).agg({
             exp_col: 'sum',
             imp_col: 'sum'
         }).round(0)
@@ -536,11 +666,11 @@ def render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi):
     
     # Preparar datos para visualización
     if analysis_type == "Exportaciones":
-        value_col = exp_col if 'exp' in filtered_df.columns else 'export'
+        value_col = exp_col
         title = "Exportaciones por Categoría"
         color_scale = "Greens"
     elif analysis_type == "Importaciones":
-        value_col = imp_col if 'imp' in filtered_df.columns else 'import'
+        value_col = imp_col
         title = "Importaciones por Categoría"
         color_scale = "Reds"
     elif analysis_type == "Balance":
@@ -548,12 +678,13 @@ def render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi):
         title = "Balance Comercial por Categoría"
         color_scale = "RdBu"
     else:  # Cobertura
+        # Columna nueva vía assign: el slice cargado no se modifica
+        value_col = 'coverage'
         if 'cov_ratio' in filtered_df.columns:
-            value_col = 'cov_ratio'
-            filtered_df[value_col] = filtered_df[value_col] * 100  # Convertir a porcentaje
+            coverage = filtered_df['cov_ratio'] * 100  # Convertir a porcentaje
         else:
-            filtered_df['coverage'] = (filtered_df[exp_col] / filtered_df[imp_col] * 100).replace([float('inf'), -float('inf')], None)
-            value_col = 'coverage'
+            coverage = (filtered_df[exp_col] / filtered_df[imp_col] * 100).replace([float('inf'), -float('inf')], None)
+        filtered_df = filtered_df.assign(coverage=coverage)
         title = "Ratio de Cobertura por Categoría (%)"
         color_scale = "Viridis"
     
@@ -583,7 +714,8 @@ def render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi):
             y=value_col,
             color='category',
             title=title,
-            color_discrete_sequence=px.colors.qualitative.Set3
+            color_discrete_sequence=px.colors.qualitative.Set3,
+            render_mode='webgl'
         )
         
         fig.update_layout(
@@ -606,7 +738,7 @@ def render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi):
     st.header("🏆 Ranking de Categorías")
     
     # Calcular ranking para el período seleccionado
-    ranking_data = filtered_df.groupby('category').agg({
+    ranking_data = filtered_df.groupby('category', observed=True, sort=False).agg({
         exp_col: 'sum',
         imp_col: 'sum'
     }).round(0)
@@ -623,24 +755,21 @@ def render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi):
     else:
         ranking_data = ranking_data.sort_values('coverage', ascending=False)
     
-    # Formatear para mostrar
-    display_ranking = ranking_data.copy()
-    display_ranking[exp_col] = display_ranking[exp_col].apply(lambda x: format_currency(x))
-    display_ranking[imp_col] = display_ranking[imp_col].apply(lambda x: format_currency(x))
-    display_ranking['balance'] = display_ranking['balance'].apply(lambda x: format_currency(x))
-    display_ranking['coverage'] = display_ranking['coverage'].apply(lambda x: f"{x:.1f}%")
-    
-    # Renombrar columnas
-    column_names = {
-        exp_col: 'Exportaciones',
-        imp_col: 'Importaciones',
-        'balance': 'Balance',
-        'coverage': 'Cobertura %'
-    }
-    display_ranking = display_ranking.rename(columns=column_names)
+    # Top N filas en miles de millones; el formato lo aplica el navegador
+    display_ranking = ranking_data.head(n_top)
+    display_ranking = display_ranking.assign(**{
+        col: display_ranking[col] / 1e9
+        for col in [exp_col, imp_col, 'balance']
+    })
     
     st.dataframe(
         display_ranking,
+        column_config={
+            exp_col: st.column_config.NumberColumn('Exportaciones', format='$%.2fB'),
+            imp_col: st.column_config.NumberColumn('Importaciones', format='$%.2fB'),
+            'balance': st.column_config.NumberColumn('Balance', format='$%.2fB'),
+            'coverage': st.column_config.NumberColumn('Cobertura %', format='%.1f%%'),
+        },
         use_container_width=True,
         height=400
     )
@@ -664,7 +793,7 @@ def render_category_analysis(prod_df, kpi_prod_df, has_prod_kpi):
         else:
             st.caption("⚠️ Datos base (ejecutar metrics_products.py para KPIs)")
 
-def render_insights_analysis(base_df, prod_df, kpi_df, kpi_prod_df, has_kpi, has_prod, has_prod_kpi):
+def render_insights_analysis(base_df, prod_df, kpi_df, kpi_prod_df, has_kpi, has_prod, has_prod_kpi, data_key):
     """Renderizar análisis de conclusiones accionables"""
     
     st.header("🚀 Conclusiones Accionables")
@@ -676,18 +805,9 @@ def render_insights_analysis(base_df, prod_df, kpi_df, kpi_prod_df, has_kpi, has
     
     # Reutilizar filtros existentes
     if has_prod and kpi_prod_df is not None:
-        # Usar datos de productos si están disponibles
+        # Usar datos de productos si están disponibles (ya ordenados desde DuckDB)
         df = kpi_prod_df if has_prod_kpi else prod_df
         
-        # Preparar datos temporales
-        month_order = [
-            "Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio",
-            "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"
-        ]
-        
-        df['month_num'] = df['month'].map({m: i+1 for i, m in enumerate(month_order)})
-        df = df.sort_values(['year', 'month_num', 'category']).reset_index(drop=True)
-        
         # ==============================================
         # RESUMEN EJECUTIVO
         # ==============================================
@@ -696,7 +816,7 @@ def render_insights_analysis(base_df, prod_df, kpi_df, kpi_prod_df, has_kpi, has
             st.subheader("📈 Resumen Ejecutivo")
             
             # Generar resumen de alto nivel
-            summary_insights = build_summary_insights(base_df, df)
+            summary_insights = _cached_summary_insights(base_df, df, data_key, has_prod_kpi)
             
             for summary in summary_insights:
                 st.markdown(summary)
@@ -719,13 +839,14 @@ def render_insights_analysis(base_df, prod_df, kpi_df, kpi_prod_df, has_kpi, has
             year_range_insights = (df['year'].max()-2, df['year'].max())
             selected_categories_insights = df['category'].unique()[:5]
         
-        # Aplicar filtros
-        mask_insights = (df['year'].between(*year_range_insights)) & (df['category'].isin(selected_categories_insights))
-        df_filtered_insights = df[mask_insights].copy()
+        # Aplicar filtros y generar insights accionables (memoizado por filtros)
+        category_insights = _cached_category_insights(
+            df, data_key, has_prod_kpi,
+            tuple(year_range_insights), tuple(selected_categories_insights)
+        )
         
-        if not df_filtered_insights.empty:
-            # Generar insights accionables
-            insights = build_insights(df_filtered_insights, top_n=3)
+        if category_insights is not None:
+            insights, stats = category_insights
             
             # Mostrar insights
             for insight in insights:
@@ -738,8 +859,6 @@ def render_insights_analysis(base_df, prod_df, kpi_df, kpi_prod_df, has_kpi, has
             
             st.subheader("📊 Estadísticas Rápidas")
             
-            stats = get_quick_stats(df_filtered_insights)
-            
             if "error" not in stats:
                 col1, col2, col3, col4 = st.columns(4)
                 
@@ -1,40 +1,70 @@
+import numpy as np
 import pandas as pd
-import calendar
-import datetime as dt
-import textwrap
+from bisect import bisect_left
 from typing import List, Dict, Any
 
+MONTHS_ES = (
+    "Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio",
+    "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"
+)
+
+_ES_TO_EN_ABBR = dict(zip(
+    MONTHS_ES,
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+     "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+))
+
+# Emoji de tendencia por tramo de YoY: umbrales (-10, 0, 10] → ⚠️, 📉, 📈, 🚀
+_TREND_THRESHOLDS = (-10, 0, 10)
+_TREND_EMOJIS = ("⚠️", "📉", "📈", "🚀")
+
+# Escala monetaria: (divisor, sufijo) de mayor a menor; por debajo de 1M, en miles
+_CURRENCY_TIERS = ((1e9, "B"), (1e6, "M"))
+_CURRENCY_DEFAULT_TIER = (1e3, "K")
+
 def _month_name(mes_str: str) -> str:
     """Convierte 'Enero' → 'Jan' para narrativa corta"""
-    months_es = [
-        "Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio",
-        "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"
-    ]
-    try:
-        idx = months_es.index(mes_str) + 1
-        return dt.date(1900, idx, 1).strftime('%b')
-    except ValueError:
-        return mes_str[:3]
+    return _ES_TO_EN_ABBR.get(mes_str, mes_str[:3])
 
 def _format_currency(value: float) -> str:
     """Formatea valores monetarios en M o B"""
-    if abs(value) >= 1e9:
-        return f"{value/1e9:.1f}B"
-    elif abs(value) >= 1e6:
-        return f"{value/1e6:.1f}M"
-    else:
-        return f"{value/1e3:.1f}K"
+    magnitude = abs(value)
+    divisor, suffix = next(
+        ((d, s) for d, s in _CURRENCY_TIERS if magnitude >= d), _CURRENCY_DEFAULT_TIER
+    )
+    return f"{value/divisor:.1f}{suffix}"
 
 def _get_trend_emoji(yoy_change: float) -> str:
     """Devuelve emoji según el cambio YoY"""
-    if yoy_change > 10:
-        return "🚀"
-    elif yoy_change > 0:
-        return "📈"
-    elif yoy_change > -10:
-        return "📉"
-    else:
-        return "⚠️"
+    # bisect_left cuenta los umbrales estrictamente menores: mismo corte que 'v > umbral'
+    return _TREND_EMOJIS[bisect_left(_TREND_THRESHOLDS, yoy_change)]
+
+# Recomendación según |YoY| de exportación: umbrales (-5, 5, 15] → tramos 0..3
+_ACTION_THRESHOLDS = np.array([-5.0, 5.0, 15.0])
+_ACTIONS = (
+    ("Revisar política sectorial y considerar incentivos específicos.", "DGCE + Gremios"),
+    ("Monitorear de cerca y preparar estrategias de diversificación de mercados.", "DGIP"),
+    ("Consolidar tendencia positiva con misiones comerciales focalizadas.", "Oficinas Comerciales"),
+    ("Intensificar promoción comercial y expandir capacidad productiva. Meta: +{extra:.0f}% adicional en Q4.", "DGCE + MINCETUR"),
+)
+
+# Plantilla Markdown de un insight, compilada una vez a nivel de módulo
+_INSIGHT_MD = """### {emoji} **Insight #{i}: {category}**
+
+**📊 Hallazgo:** Las exportaciones de **{category}** {trend_text} **{yoy:+.1f}% YoY** en {month} {year}.
+
+**💰 Impacto:** {impact_detail}. Tendencia {tendency} para la balanza sectorial.
+
+**🎯 Acción:** {action}
+- **Responsable:** {responsible}  
+- **Plazo:** Q4 {year}
+- **Seguimiento:** Reunión mensual DGCE
+
+---""".format
+
+def _action_buckets(yoy: np.ndarray) -> np.ndarray:
+    """Tramo de recomendación para todo el arreglo de YoY (v > umbral, como los if/elif)"""
+    return np.searchsorted(_ACTION_THRESHOLDS, yoy, side='left')
 
 def build_insights(df_view: pd.DataFrame, top_n: int = 3) -> List[str]:
     """
@@ -71,58 +101,44 @@ def build_insights(df_view: pd.DataFrame, top_n: int = 3) -> List[str]:
     if 'balance' not in sub.columns:
         sub['balance'] = 0
     
-    # Ordenar por variación export YoY (absoluto desc)
-    ordered = (sub
-               .sort_values('exp_yoy', key=lambda s: s.abs(), ascending=False)
-               .head(top_n)
-               .to_dict('records'))
+    # Top N por variación export YoY (absoluto desc): selección parcial, sin ordenar todo
+    top = (sub
+           .assign(_abs_yoy=sub['exp_yoy'].abs())
+           .nlargest(top_n, '_abs_yoy'))
+
+    # Columnas como arreglos (sin un dict por fila); las ausentes con su valor por defecto
+    def column(name, default):
+        if name in top.columns:
+            return top[name].to_numpy()
+        return np.full(len(top), default, dtype=object)
 
+    yoys = top['exp_yoy'].to_numpy(dtype='float64')
+    columns = zip(column('category', 'N/A'), yoys, column('balance', 0),
+                  column('month', 'Dic'), column('year', latest_year),
+                  _action_buckets(yoys))  # tramos de recomendación, una sola vez
+    
     insights = []
     
-    for i, record in enumerate(ordered, 1):
-        category = record.get('category', 'N/A')
-        yoy = record.get('exp_yoy', 0)
-        balance = record.get('balance', 0)
-        month = record.get('month', 'Dic')
-        year = record.get('year', latest_year)
-        
+    for i, (category, yoy, balance, month, year, bucket) in enumerate(columns, 1):
         # Determinar tipo de insight
         emoji = _get_trend_emoji(yoy)
         trend_text = "crecieron" if yoy > 0 else "decrecieron"
         
-        # Generar recomendaciones específicas
-        if yoy > 15:
-            action = f"Intensificar promoción comercial y expandir capacidad productiva. Meta: +{yoy*.1:.0f}% adicional en Q4."
-            responsible = "DGCE + MINCETUR"
-        elif yoy > 5:
-            action = f"Consolidar tendencia positiva con misiones comerciales focalizadas."
-            responsible = "Oficinas Comerciales"
-        elif yoy > -5:
-            action = f"Monitorear de cerca y preparar estrategias de diversificación de mercados."
-            responsible = "DGIP"
-        else:
-            action = f"Revisar política sectorial y considerar incentivos específicos."
-            responsible = "DGCE + Gremios"
+        # Recomendación específica según el tramo
+        action_template, responsible = _ACTIONS[bucket]
+        action = action_template.format(extra=yoy * .1)
         
         # Contexto adicional
         balance_txt = "superávit" if balance > 0 else "déficit"
         impact_detail = f"Contribuye con US$ {_format_currency(abs(balance))} al {balance_txt} comercial"
         
-        insight_md = f"""
-### {emoji} **Insight #{i}: {category}**
-
-**📊 Hallazgo:** Las exportaciones de **{category}** {trend_text} **{yoy:+.1f}% YoY** en {_month_name(month)} {year}.
-
-**💰 Impacto:** {impact_detail}. Tendencia {'favorable' if yoy > 0 else 'adversa'} para la balanza sectorial.
-
-**🎯 Acción:** {action}
-- **Responsable:** {responsible}  
-- **Plazo:** Q4 {year}
-- **Seguimiento:** Reunión mensual DGCE
-
----
-"""
-        insights.append(insight_md.strip())
+        insights.append(_INSIGHT_MD(
+            emoji=emoji, i=i, category=category, trend_text=trend_text,
+            yoy=yoy, month=_month_name(month), year=year,
+            impact_detail=impact_detail,
+            tendency='favorable' if yoy > 0 else 'adversa',
+            action=action, responsible=responsible
+        ))
     
     return insights
 
@@ -152,10 +168,12 @@ def build_summary_insights(df_country: pd.DataFrame, df_products: pd.DataFrame)
         
         if exp_col and 'category' in products_latest.columns:
             try:
-                category_sums = products_latest.groupby('category')[exp_col].sum().sort_values(ascending=False)
+                # Un solo groupby y un argmax (sin ordenar toda la serie)
+                category_sums = products_latest.groupby('category', observed=True)[exp_col].sum()
                 if not category_sums.empty:
-                    top_category = category_sums.index[0]
-                    top_value = category_sums.iloc[0]
+                    idx = category_sums.values.argmax()
+                    top_category = category_sums.index[idx]
+                    top_value = category_sums.values[idx]
                 else:
                     top_category = "N/A"
                     top_value = 0
@@ -0,0 +1,17 @@
+"""Constantes de calendario compartidas por los scripts del observatorio"""
+
+import pandas as pd
+
+MONTHS = [
+    "Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio",
+    "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"
+]
+
+# Número de mes (1-12) por nombre, para mapear sin reconstruir el dict en cada llamada
+MONTH_TO_NUM: dict[str, int] = {m: i + 1 for i, m in enumerate(MONTHS)}
+
+# Dtype categórico ordenado: los códigos (0-11) dan el orden cronológico
+MONTH_CAT = pd.CategoricalDtype(MONTHS, ordered=True)
+
+# Lista de meses como literal SQL para list_position() en DuckDB
+MONTHS_SQL = "[" + ", ".join(f"'{m}'" for m in MONTHS) + "]"
@@ -0,0 +1,27 @@
+"""Kernels numéricos compartidos por los scripts del observatorio"""
+
+import numpy as np
+
+def rolling_means(x, *windows: int) -> list[np.ndarray]:
+    """Medias móviles con min_periods=1 para varias ventanas (semántica de pandas: ignora NaN).
+
+    Una sola pasada de sumas acumuladas compartida por todas las ventanas: la
+    suma de cada ventana es la diferencia entre dos prefijos, sin reservar
+    memoria por ventana ni volver a recorrer la serie.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    valid = ~np.isnan(x)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(valid, x, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+    ends = np.arange(1, x.size + 1)
+
+    means = []
+    for window in windows:
+        start = np.maximum(ends - window, 0)
+        window_sums = sums[1:] - sums[start]
+        window_counts = counts[1:] - counts[start]
+
+        out = np.full(x.size, np.nan)
+        np.divide(window_sums, window_counts, out=out, where=window_counts > 0)
+        means.append(out)
+    return means
@@ -0,0 +1,31 @@
+"""Caché Parquet de los libros Excel ya parseados (se reutiliza mientras el libro no cambie)"""
+
+from pathlib import Path
+import pandas as pd
+
+# Constantes compartidas (meses) de las que depende el parseo: también invalidan la caché
+_CONSTANTS_FILE = Path(__file__).with_name("_constants.py")
+
+def _cache_file(path: Path, flow: str) -> Path:
+    """data/.cache/<libro>.<flujo>.parquet, junto al libro de origen"""
+    return path.parent / ".cache" / f"{path.stem}.{flow}.parquet"
+
+def load_cached(path: Path, flow: str, parser_file: str) -> pd.DataFrame | None:
+    """Formato largo cacheado, o None si el libro, el parser o las constantes son más nuevos que la caché"""
+    cache = _cache_file(path, flow)
+    if not cache.exists():
+        return None
+    source_mtime = max(
+        path.stat().st_mtime_ns,
+        Path(parser_file).stat().st_mtime_ns,
+        _CONSTANTS_FILE.stat().st_mtime_ns,
+    )
+    if cache.stat().st_mtime_ns < source_mtime:
+        return None
+    return pd.read_parquet(cache)
+
+def save_cached(path: Path, flow: str, df: pd.DataFrame) -> None:
+    """Guarda el formato largo del libro para las siguientes corridas"""
+    cache = _cache_file(path, flow)
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(cache, index=False)
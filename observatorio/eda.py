@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 """Análisis Exploratorio de Datos (EDA) - Observatorio de Comercio Perú"""
 
-import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
@@ -9,6 +8,9 @@ from plotly.subplots import make_subplots
 import duckdb
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from _constants import MONTHS, MONTH_CAT
+from _kernels import rolling_means
 
 def run_eda():
     """Ejecuta análisis exploratorio completo"""
@@ -19,8 +21,11 @@ def run_eda():
     
     print("🔍 Iniciando Análisis Exploratorio de Datos...")
     
-    # Conectar a DuckDB
-    con = duckdb.connect("trade.duckdb")
+    # Figuras a exportar como (figura, ruta); se escriben juntas al final
+    figures = []
+    
+    # Conectar a DuckDB (solo lectura: el EDA no escribe en la base)
+    con = duckdb.connect("trade.duckdb", read_only=True)
     
     # Cargar datos KPI (si existen, sino usar datos base)
     try:
@@ -41,16 +46,14 @@ def run_eda():
         """).df()
     
     # Preparar datos temporales
-    month_order = [
-        "Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio",
-        "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"
-    ]
-    
-    df['month_num'] = df['month'].map({m: i+1 for i, m in enumerate(month_order)})
+    # Mes como categórico ordenado: month_num sale de los códigos (int8), sin mapear strings
+    df['month'] = df['month'].astype(MONTH_CAT)
+    df['month_num'] = df['month'].cat.codes.astype(np.int8) + 1
     df = df.sort_values(['year', 'month_num'])
     
-    # Crear columna de fecha
-    df['date'] = pd.to_datetime(df['year'].astype(str) + '-' + df['month_num'].astype(str), format='%Y-%m')
+    # Crear columna de fecha: meses desde 1970-01 → datetime64, sin construir strings
+    months_since_epoch = (df['year'].to_numpy(np.int64) - 1970) * 12 + (df['month_num'].to_numpy(np.int64) - 1)
+    df['date'] = months_since_epoch.astype('datetime64[M]').astype('datetime64[ns]')
     
     # =====================================================
     # 1. ANÁLISIS DE SERIES TEMPORALES
@@ -81,7 +84,7 @@ def run_eda():
         hovermode='x unified'
     )
     
-    fig1.write_html(reports_dir / "series_temporal.html")
+    figures.append((fig1, reports_dir / "series_temporal.html"))
     
     # =====================================================
     # 2. ANÁLISIS DE ESTACIONALIDAD
@@ -89,13 +92,16 @@ def run_eda():
     
     print("🗓️  2. Analizando patrones estacionales...")
     
-    # Heatmap año × mes para exportaciones
-    heat_data = df.pivot(index='month_num', columns='year', values='export')
+    # Heatmap año × mes para exportaciones: cada valor va directo a su celda de
+    # la grilla 12 × años (los meses faltantes del año en curso quedan NaN)
+    years, year_pos = np.unique(df['year'].to_numpy(), return_inverse=True)
+    heat_values = np.full((12, len(years)), np.nan)
+    heat_values[df['month_num'].to_numpy() - 1, year_pos] = df['export'].to_numpy()
     
     fig2 = px.imshow(
-        heat_data.values,
-        x=heat_data.columns,
-        y=[month_order[i-1] for i in heat_data.index],
+        heat_values,
+        x=years,
+        y=MONTHS,
         aspect='auto',
         color_continuous_scale='RdYlGn',
         title='🌡️ Estacionalidad de Exportaciones (Heatmap)'
@@ -106,7 +112,7 @@ def run_eda():
         yaxis_title='Mes'
     )
     
-    fig2.write_html(reports_dir / "estacionalidad_heatmap.html")
+    figures.append((fig2, reports_dir / "estacionalidad_heatmap.html"))
     
     # Box plot por mes
     fig3 = px.box(
@@ -114,7 +120,7 @@ def run_eda():
         title='📦 Distribución de Exportaciones por Mes'
     )
     fig3.update_xaxes(tickangle=45)
-    fig3.write_html(reports_dir / "distribucion_mensual.html")
+    figures.append((fig3, reports_dir / "distribucion_mensual.html"))
     
     # =====================================================
     # 3. ANÁLISIS DE TENDENCIAS
@@ -122,9 +128,8 @@ def run_eda():
     
     print("📊 3. Identificando tendencias y ciclos...")
     
-    # Calcular medias móviles
-    df['export_ma12'] = df['export'].rolling(12, min_periods=1).mean()
-    df['export_ma24'] = df['export'].rolling(24, min_periods=1).mean()
+    # Calcular medias móviles (12 y 24 meses en una sola pasada)
+    df['export_ma12'], df['export_ma24'] = rolling_means(df['export'].to_numpy(dtype='float64'), 12, 24)
     
     fig4 = go.Figure()
     fig4.add_trace(go.Scatter(
@@ -147,7 +152,7 @@ def run_eda():
         template='plotly_white'
     )
     
-    fig4.write_html(reports_dir / "tendencias.html")
+    figures.append((fig4, reports_dir / "tendencias.html"))
     
     # =====================================================
     # 4. ANÁLISIS DE OUTLIERS Y EVENTOS
@@ -155,15 +160,21 @@ def run_eda():
     
     print("🔍 4. Detectando outliers y eventos atípicos...")
     
-    # Variaciones mensuales
-    df['export_pct_change'] = df['export'].pct_change() * 100
-    df['import_pct_change'] = df['import'].pct_change() * 100
+    # Variaciones mensuales (ndarray float64; la primera fila queda NaN)
+    def pct_change(values):
+        pct = np.full(values.size, np.nan)
+        pct[1:] = (values[1:] / values[:-1] - 1) * 100
+        return pct
     
-    # Detectar outliers (>2 desviaciones estándar)
-    export_std = df['export_pct_change'].std()
-    export_mean = df['export_pct_change'].mean()
+    export_pct = pct_change(df['export'].to_numpy(dtype='float64'))
+    df['export_pct_change'] = export_pct
+    df['import_pct_change'] = pct_change(df['import'].to_numpy(dtype='float64'))
     
-    outliers = df[abs(df['export_pct_change'] - export_mean) > 2 * export_std]
+    # Detectar outliers (>2 desviaciones estándar), un solo z-score sobre el arreglo
+    export_std = np.nanstd(export_pct, ddof=1)
+    export_mean = np.nanmean(export_pct)
+    
+    outliers = df[np.abs(export_pct - export_mean) > 2 * export_std]
     
     fig5 = go.Figure()
     fig5.add_trace(go.Scatter(
@@ -188,7 +199,7 @@ def run_eda():
         template='plotly_white'
     )
     
-    fig5.write_html(reports_dir / "outliers.html")
+    figures.append((fig5, reports_dir / "outliers.html"))
     
     # =====================================================
     # 5. DASHBOARD RESUMEN
@@ -240,7 +251,11 @@ def run_eda():
         height=600
     )
     
-    fig6.write_html(reports_dir / "dashboard_eda.html")
+    figures.append((fig6, reports_dir / "dashboard_eda.html"))
+    
+    # Exportar los HTML en paralelo; plotly.js desde CDN en vez de embebido en cada archivo
+    with ThreadPoolExecutor(max_workers=len(figures)) as ex:
+        list(ex.map(lambda item: item[0].write_html(item[1], include_plotlyjs='cdn'), figures))
     
     # =====================================================
     # 6. GENERAR REPORTE RESUMEN
@@ -256,8 +271,8 @@ def run_eda():
         'export_max_date': df.loc[df['export'].idxmax(), 'date'].strftime('%Y-%m'),
         'balance_positive_months': (df['balance'] > 0).sum(),
         'total_months': len(df),
-        'peak_month': df.groupby('month')['export'].mean().idxmax(),
-        'low_month': df.groupby('month')['export'].mean().idxmin(),
+        'peak_month': df.groupby('month', observed=True)['export'].mean().idxmax(),
+        'low_month': df.groupby('month', observed=True)['export'].mean().idxmin(),
         'outliers_count': len(outliers)
     }
     
@@ -3,60 +3,90 @@
 
 import re
 import duckdb
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import openpyxl
 import pandas as pd
 from pathlib import Path
 from rich.console import Console
 from rich.table import Table
+from _constants import MONTH_TO_NUM, MONTHS_SQL
+from _xlsx_cache import load_cached, save_cached
 
-MONTHS = [
-    "Enero","Febrero","Marzo","Abril","Mayo","Junio",
-    "Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"
-]
 SRC = {
     "import": Path("data/cdro_F8.xlsx"),
     "export": Path("data/cdro_G6.xlsx"),
 }
 
-def parse_book(path: Path, flow: str) -> pd.DataFrame:
-    """Extrae la fila 'Total general' de cada hoja-año y la convierte a formato largo"""
-    tidy = []
-    xls = pd.ExcelFile(path)
-    for sheet in xls.sheet_names:
-        if not re.fullmatch(r"\d{4}", sheet):
-            continue                       # solo hojas con nombre tipo 2014
-        year = int(sheet)
-        df = xls.parse(sheet, header=None)
+def _cell(row: tuple, col: int):
+    """Valor de la columna `col`; las filas en modo read_only pueden venir recortadas"""
+    return row[col] if col < len(row) else None
 
-        # — localizar la fila de encabezados (donde aparece 'Enero') —
-        hdr_idx = next(
-            idx for idx, row in df.iterrows()
-            if any(str(v).strip() == "Enero" for v in row)
-        )
-        header = df.loc[hdr_idx]
-        col_meses = [i for i,v in header.items() if str(v).strip() in MONTHS]
-        col_total = header[header=="Total"].index[0]
-
-        # — localizar la fila 'Total general' —
-        tot_idx = next(
-            idx for idx, row in df.iterrows()
-            if any(isinstance(v,str) and "Total general" in v for v in row)
+# Libros abiertos por proceso: cada worker abre cada archivo una sola vez
+_WORKBOOKS = {}
+
+def _workbook(path: Path):
+    """Libro en modo read_only (streaming), cacheado por ruta dentro del proceso"""
+    if path not in _WORKBOOKS:
+        _WORKBOOKS[path] = openpyxl.load_workbook(
+            path, read_only=True, data_only=True, keep_links=False
         )
+    return _WORKBOOKS[path]
+
+def year_sheets(path: Path) -> list[str]:
+    """Hojas con nombre tipo 2014 (abre y cierra el libro: el proceso padre no
+    debe heredar archivos abiertos a los workers)"""
+    wb = openpyxl.load_workbook(path, read_only=True, keep_links=False)
+    try:
+        return [name for name in wb.sheetnames if re.fullmatch(r"\d{4}", name)]
+    finally:
+        wb.close()
+
+def _parse_sheet(path: Path, sheet: str, flow: str) -> pd.DataFrame:
+    """Extrae la fila 'Total general' de una hoja-año en formato largo"""
+    year = int(sheet)
+    ws = _workbook(path)[sheet]
+    ws.reset_dimensions()                  # no confiar en la dimensión declarada
+    header = None
+
+    # Lectura en streaming: solo se recorren filas hasta 'Total general'
+    for row in ws.iter_rows(values_only=True):
+        # — localizar la fila de encabezados (donde aparece 'Enero') —
+        if header is None:
+            labels = [str(v).strip() for v in row]
+            if "Enero" in labels:
+                header = labels
+                col_meses = [i for i, v in enumerate(labels) if v in MONTH_TO_NUM]
+                col_total = row.index("Total")
+            continue
+
+        # — localizar la fila 'Total general' y cortar la lectura —
+        if not any(isinstance(v, str) and "Total general" in v for v in row):
+            continue
 
-        # — registrar valores —
-        for col in col_meses:
-            tidy.append({
-                "year": year,
-                "month": header[col].strip(),
-                "flow" : flow,
-                "usd"  : float(df.iat[tot_idx, col]),
-            })
-
-        tidy.append({                        # fila anual para QA
-            "year": year, "month":"Total", "flow":flow,
-            "usd" : float(df.iat[tot_idx, col_total]),
-            "sum_months": float(df.iloc[tot_idx, col_meses].sum())
+        # — registrar valores: meses + fila anual 'Total' para QA, en columnas tipadas
+        #   (celdas vacías llegan como None y quedan NaN, como en la lectura con Pandas) —
+        values = np.array(
+            [_cell(row, c) for c in col_meses + [col_total]], dtype=np.float64
+        )
+        n = len(col_meses)
+        return pd.DataFrame({
+            "year": np.full(n + 1, year, dtype=np.int16),
+            "month": [header[c] for c in col_meses] + ["Total"],
+            "flow": flow,
+            "usd": values,
+            "sum_months": np.append(np.full(n, np.nan), np.nansum(values[:n])),
         })
-    return pd.DataFrame(tidy)
+    # Una hoja-año sin encabezado o sin total detiene el ETL: no se omite en silencio
+    # (tampoco llega a la caché Parquet un libro incompleto)
+    raise ValueError(f"{path.name}:{sheet}: no se encontró encabezado 'Enero' o fila 'Total general'")
+
+def parse_book(path: Path, flow: str) -> pd.DataFrame:
+    """Extrae la fila 'Total general' de cada hoja-año y la convierte a formato largo"""
+    return pd.concat(
+        [_parse_sheet(path, sheet, flow) for sheet in year_sheets(path)],
+        ignore_index=True
+    )
 
 def qa_report(df_tot: pd.DataFrame):
     """Imprime diferencias entre suma mensual y total anual"""
@@ -64,30 +94,64 @@ def qa_report(df_tot: pd.DataFrame):
     table = Table(title="QA: Total anual vs. suma de meses")
     for col in ["Año","Flujo","Total libro","Suma meses","Δ"]:
         table.add_column(col, justify="right")
-    for _,row in df_tot.iterrows():
-        diff = row["usd"]-row["sum_months"]
+    rows = df_tot[["year","flow","usd","sum_months"]].itertuples(index=False, name=None)
+    for year, flow, usd, sum_months in rows:
+        diff = usd-sum_months
         table.add_row(
-            str(int(row["year"])), row["flow"],
-            f"{row['usd']:,.0f}", f"{row['sum_months']:,.0f}",
+            str(int(year)), flow,
+            f"{usd:,.0f}", f"{sum_months:,.0f}",
             f"{diff:,.2f}"
         )
     console.print(table)
 
+def create_monthly_table(con):
+    """Materializa el agregado mensual export/import que consume el dashboard"""
+    con.execute(f"""
+        CREATE OR REPLACE TABLE trade_monthly AS
+        SELECT year, month, month_num, export, import, export - import AS balance
+        FROM (
+            SELECT
+                year, month, list_position({MONTHS_SQL}, month) AS month_num,
+                SUM(usd) FILTER (WHERE flow='export') AS export,
+                SUM(usd) FILTER (WHERE flow='import') AS import
+            FROM trade
+            WHERE month != 'Total'
+            GROUP BY year, month
+        )
+        ORDER BY year, month_num
+    """)
+
 def main():
-    # 1) Ingesta
-    frames = [parse_book(path, flow) for flow, path in SRC.items()]
-    df = pd.concat(frames, ignore_index=True)
+    # 1) Ingesta: los libros sin cambios salen de la caché Parquet; el resto se
+    #    parsea por hoja-año, repartido entre procesos
+    books = {flow: load_cached(path, flow, __file__) for flow, path in SRC.items()}
+    tasks = [
+        (path, sheet, flow) for flow, path in SRC.items() if books[flow] is None
+        for sheet in year_sheets(path)
+    ]
+    if tasks:
+        with ProcessPoolExecutor() as ex:
+            parsed = pd.concat(ex.map(_parse_sheet, *zip(*tasks)), ignore_index=True)
+        for flow, path in SRC.items():
+            if books[flow] is None:
+                books[flow] = parsed[parsed["flow"] == flow].reset_index(drop=True)
+                save_cached(path, flow, books[flow])
+    df = pd.concat(books.values(), ignore_index=True)
 
     # 2) QA
     df_tot = df[df["month"]=="Total"].copy()
     qa_report(df_tot)
 
-    # 3) Persistencia (duckdb + parquet opcional)
+    # 3) Persistencia (duckdb + parquet opcional): el DataFrame se registra como
+    #    vista (sin copia) y el Parquet sale de DuckDB, sin pasar por df.to_parquet
     con = duckdb.connect("trade.duckdb")
-    con.execute("CREATE OR REPLACE TABLE trade AS SELECT * FROM df")
+    con.register("df_view", df)
+    con.execute("CREATE OR REPLACE TABLE trade AS SELECT * FROM df_view")
+    con.unregister("df_view")
+    create_monthly_table(con)
+    con.execute("COPY trade TO 'trade.parquet' (FORMAT PARQUET)")
     con.close()
-    df.to_parquet("trade.parquet", index=False)
-    print("\n✓ ETL completado → trade.duckdb & trade.parquet")
+    print("\n✓ ETL completado → trade.duckdb (trade, trade_monthly) & trade.parquet")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -5,95 +5,95 @@ Genera tabla trade_prod en trade.duckdb y archivo trade_prod.parquet
 """
 
 import duckdb
+import numpy as np
+import openpyxl
 import pandas as pd
 import re
 from pathlib import Path
 from rich import print, box
 from rich.table import Table
 from rich.console import Console
-
-MONTHS = ["Enero","Febrero","Marzo","Abril","Mayo","Junio",
-          "Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
+from _constants import MONTHS
+from _xlsx_cache import load_cached, save_cached
 
 SRC = {
     "import": Path("data/cdro_F1.xlsx"),   # libro F1: importaciones
     "export": Path("data/cdro_G1.xlsx"),   # libro G1: exportaciones
 }
 
+def _sheet_array(ws) -> np.ndarray:
+    """Valores de la hoja (lectura read_only en streaming) como ndarray object, sin DataFrame"""
+    ws.reset_dimensions()                  # no confiar en la dimensión declarada
+    rows = list(ws.iter_rows(values_only=True))
+    width = max(map(len, rows), default=0)
+    arr = np.full((len(rows), width), None, dtype=object)
+    for i, row in enumerate(rows):
+        arr[i, :len(row)] = row
+    return arr
+
 def parse_book(path: Path, flow: str) -> pd.DataFrame:
     """Convierte cada hoja-año en formato largo con columna category"""
-    records = []
-    xls = pd.ExcelFile(path)
+    # Columnas acumuladas por hoja (arreglos ya tipados: year int16, usd float64),
+    # sin un dict por registro ni inferencia de tipos al final
+    columns = {"year": [], "month": [], "category": [], "usd": []}
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
     
     print(f"📖 Procesando {flow}: {path.name}")
     
-    for sheet in xls.sheet_names:
-        if not re.fullmatch(r"\d{4}", sheet):
+    for ws in wb.worksheets:
+        if not re.fullmatch(r"\d{4}", ws.title):
             continue
             
-        year = int(sheet)
+        year = int(ws.title)
         print(f"   → Año {year}")
-        df = xls.parse(sheet, header=None)
+        arr = _sheet_array(ws)
 
-        # 1. Localizar fila de encabezados (donde está 'Enero')
-        try:
-            head_idx = next(i for i, row in df.iterrows() 
-                          if any(str(cell).strip() == "Enero" for cell in row))
-        except StopIteration:
+        # 1. Localizar fila de encabezados (donde está 'Enero'), vectorizado sobre el ndarray
+        cells = np.char.strip(arr.astype(str))
+        head_rows = np.flatnonzero((cells == "Enero").any(axis=1))
+        if head_rows.size == 0:
             print(f"   ⚠️  No se encontró encabezado 'Enero' en {year}")
             continue
+        head_idx = int(head_rows[0])
             
         # Mapear columnas de meses
-        col_map = {}
-        for c in range(df.shape[1]):
-            cell_val = str(df.iat[head_idx, c]).strip()
-            if cell_val in MONTHS + ["Total"]:
-                col_map[c] = cell_val
+        header = cells[head_idx]
+        month_cols = np.flatnonzero(np.isin(header, MONTHS + ["Total"]))
 
-        if not col_map:
+        if month_cols.size == 0:
             print(f"   ⚠️  No se encontraron columnas de meses en {year}")
             continue
 
-        # 2. Iterar filas-categoría a partir de head_idx+3
-        categories_found = 0
-        for r in range(head_idx + 3, df.shape[0]):
-            if r >= len(df):
-                break
-                
-            # Obtener categoría de la columna 2 (generalmente donde está el nombre)
-            cat_cell = df.iat[r, 2] if df.shape[1] > 2 else df.iat[r, 0]
-            cat = str(cat_cell).strip()
-            
-            # Filtrar filas vacías o metadata
-            if (not cat or 
-                cat.lower() in ['nan', 'none', ''] or
-                cat.lower().startswith("incluye") or
-                cat.lower().startswith("total") or
-                len(cat) < 3):
-                continue
-                
-            categories_found += 1
-            
-            # Extraer valores por mes
-            for col, mes in col_map.items():
-                try:
-                    val = df.iat[r, col]
-                    if pd.isna(val) or val == '' or val == 0:
-                        continue
-                        
-                    records.append({
-                        "year": year,
-                        "month": mes,
-                        "flow": flow,
-                        "category": cat,
-                        "usd": float(val),
-                    })
-                except (ValueError, IndexError):
-                    continue
+        # 2. Filas-categoría a partir de head_idx+3, como un solo bloque
+        # (categoría en la columna 2, generalmente donde está el nombre)
+        cats = cells[head_idx + 3:, 2 if arr.shape[1] > 2 else 0]
+        lower = np.char.lower(cats)
+        
+        # Filtrar filas vacías o metadata
+        is_cat = ((np.char.str_len(cats) >= 3) &
+                  ~np.isin(lower, ['nan', 'none']) &
+                  ~np.char.startswith(lower, "incluye") &
+                  ~np.char.startswith(lower, "total"))
+        categories_found = int(is_cat.sum())
+        
+        # Extraer valores por mes: celdas vacías o no numéricas → NaN; se omiten NaN y ceros
+        block = arr[head_idx + 3:][is_cat][:, month_cols]
+        usd = pd.to_numeric(block.ravel(), errors="coerce").astype(np.float64).reshape(block.shape)
+        rows, cols = np.nonzero(~np.isnan(usd) & (usd != 0))
+        
+        columns["year"].append(np.full(rows.size, year, dtype=np.int16))
+        columns["month"].append(header[month_cols][cols])
+        columns["category"].append(cats[is_cat][rows])
+        columns["usd"].append(usd[rows, cols])
         
         print(f"      {categories_found} categorías encontradas")
     
-    df_result = pd.DataFrame(records)
+    wb.close()
+    if columns["usd"]:
+        df_result = pd.DataFrame({name: np.concatenate(parts) for name, parts in columns.items()})
+        df_result.insert(2, "flow", flow)
+    else:
+        df_result = pd.DataFrame()
     print(f"   📊 Total registros: {len(df_result)}")
     return df_result
 
@@ -101,54 +101,83 @@ def qa_totals(df_long: pd.DataFrame) -> None:
     """Compara suma de los 12 meses vs. Total anual por (year,flow,category)"""
     print("\n🔍 Ejecutando QA de totales...")
     
-    # Suma mensual por (year, flow, category)
-    df_monthly = (df_long[df_long["month"] != "Total"]
-                 .groupby(["year", "flow", "category"])["usd"]
-                 .sum()
-                 .reset_index()
-                 .rename(columns={"usd": "sum_months"}))
+    # DuckDB en memoria directamente sobre el DataFrame (sin groupby/merge en Pandas)
+    con = duckdb.connect()
+    con.register("t", df_long)
     
-    # Totales anuales
-    df_total = (df_long[df_long["month"] == "Total"]
-               .groupby(["year", "flow", "category"])["usd"]
-               .sum()
-               .reset_index()
-               .rename(columns={"usd": "usd_total"}))
-    
-    # Comparar
-    if df_total.empty:
+    has_totals = con.execute("SELECT count(*) > 0 FROM t WHERE month = 'Total'").fetchone()[0]
+    if not has_totals:
+        con.close()
         print("[yellow]⚠️  No se encontraron filas 'Total' - saltando QA[/]")
         return
-        
-    joined = df_monthly.merge(df_total, on=["year", "flow", "category"], how="left")
-    joined["Δ"] = joined["usd_total"] - joined["sum_months"]
     
-    # Filtrar diferencias significativas
-    bad = joined[joined["Δ"].abs() > 1e-3]
+    # Suma mensual vs. total anual por (year, flow, category); solo diferencias
+    # significativas, las 5 peores más el conteo total de discrepancias
+    worst = con.execute("""
+        WITH monthly AS (
+            SELECT year, flow, category, SUM(usd) AS sum_months
+            FROM t WHERE month != 'Total'
+            GROUP BY year, flow, category
+        ),
+        annual AS (
+            SELECT year, flow, category, SUM(usd) AS usd_total
+            FROM t WHERE month = 'Total'
+            GROUP BY year, flow, category
+        )
+        SELECT
+            year, flow, category, usd_total, sum_months,
+            usd_total - sum_months AS delta,
+            COUNT(*) OVER () AS n_bad
+        FROM monthly JOIN annual USING (year, flow, category)
+        WHERE ABS(usd_total - sum_months) > 1e-3
+        ORDER BY delta DESC
+        LIMIT 5
+    """).fetchall()
+    con.close()
     
-    if bad.empty:
+    if not worst:
         print("[green]✓ QA: Totales anuales coinciden con suma de meses[/]")
     else:
-        print(f"[yellow]⚠️  {len(bad)} discrepancias encontradas (diferencias > $1K)[/]")
+        n_bad = worst[0][-1]
+        print(f"[yellow]⚠️  {n_bad} discrepancias encontradas (diferencias > $1K)[/]")
         
         # Mostrar solo las 5 peores
-        worst = bad.nlargest(5, "Δ")
         tbl = Table(title="❌ QA: diferencias detectadas", box=box.SIMPLE)
         for col in ["year", "flow", "category", "usd_total", "sum_months", "Δ"]:
             tbl.add_column(col)
             
-        for _, row in worst.iterrows():
+        for year, flow, category, usd_total, sum_months, delta, _ in worst:
             tbl.add_row(
-                str(int(row["year"])),
-                row["flow"],
-                row["category"][:30] + "..." if len(row["category"]) > 30 else row["category"],
-                f"{row['usd_total']:,.0f}" if pd.notna(row['usd_total']) else "N/A",
-                f"{row['sum_months']:,.0f}",
-                f"{row['Δ']:,.0f}"
+                str(int(year)),
+                flow,
+                category[:30] + "..." if len(category) > 30 else category,
+                f"{usd_total:,.0f}",
+                f"{sum_months:,.0f}",
+                f"{delta:,.0f}"
             )
         
         Console().print(tbl)
-        print(f"[yellow]Continuando con {len(bad)} discrepancias menores...[/]")
+        print(f"[yellow]Continuando con {n_bad} discrepancias menores...[/]")
+
+# Suma de meses vs. Total anual por (year,flow,category); base de la vista de QA
+QA_MONTHLY_VS_TOTAL_SQL = """
+    SELECT
+        year, flow, category, sum_months, total_annual,
+        ABS(sum_months - total_annual) AS difference
+    FROM (
+        SELECT 
+            year, flow, category,
+            SUM(CASE WHEN month != 'Total' THEN usd ELSE 0 END) AS sum_months,
+            MAX(CASE WHEN month = 'Total' THEN usd ELSE 0 END) AS total_annual
+        FROM trade_prod
+        GROUP BY year, flow, category
+        HAVING MAX(CASE WHEN month = 'Total' THEN usd ELSE 0 END) > 0
+    )
+"""
+
+def create_qa_view(con):
+    """Vista suma de meses vs. Total anual por (year,flow,category) que consultan los tests de QA"""
+    con.execute(f"CREATE OR REPLACE VIEW qa_monthly_vs_total AS {QA_MONTHLY_VS_TOTAL_SQL}")
 
 def main():
     print("[bold cyan]🇵🇪 ETL DE PRODUCTOS - OBSERVATORIO COMERCIO PERÚ[/]")
@@ -167,7 +196,14 @@ def main():
     frames = []
     for flow, path in SRC.items():
         try:
-            df = parse_book(path, flow)
+            # Libro sin cambios desde la última corrida: leer la caché Parquet
+            df = load_cached(path, flow, __file__)
+            if df is None:
+                df = parse_book(path, flow)
+                if not df.empty:
+                    save_cached(path, flow, df)
+            else:
+                print(f"📦 {flow}: {path.name} sin cambios, usando caché")
             if not df.empty:
                 frames.append(df)
             else:
@@ -193,12 +229,16 @@ def main():
     # Persistencia
     print("\n💾 Guardando datos...")
     try:
+        # DataFrame registrado como vista (sin copia); el Parquet sale de DuckDB
         con = duckdb.connect("trade.duckdb")
-        con.execute("CREATE OR REPLACE TABLE trade_prod AS SELECT * FROM df")
-        con.close()
-        print("[green]✅ DuckDB: trade_prod creada[/]")
+        con.register("df_view", df)
+        con.execute("CREATE OR REPLACE TABLE trade_prod AS SELECT * FROM df_view")
+        con.unregister("df_view")
+        create_qa_view(con)
+        print("[green]✅ DuckDB: trade_prod creada (+ vista qa_monthly_vs_total)[/]")
         
-        df.to_parquet("trade_prod.parquet", index=False)
+        con.execute("COPY trade_prod TO 'trade_prod.parquet' (FORMAT PARQUET)")
+        con.close()
         print("[green]✅ Parquet: trade_prod.parquet generado[/]")
         
         print("\n[bold green]✓ trade_prod listo → parquet y duckdb[/]")
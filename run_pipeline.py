@@ -1,34 +1,89 @@
 #!/usr/bin/env python
 """Pipeline automatizado completo - Observatorio de Comercio Perú 🇵🇪"""
 
+import os
+import stat
 import subprocess
 import sys
 import time
-from pathlib import Path
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-def run_command(cmd, description):
-    """Ejecutar comando con logging"""
-    print(f"\n🔄 {description}")
-    print(f"   Comando: {cmd}")
-    print("   " + "="*50)
+# DAG del pipeline: paso → (comando, descripción, dependencias).
+# DuckDB admite un solo proceso escritor sobre trade.duckdb (y ningún lector
+# mientras tanto), así que los pasos que escriben van encadenados; solo EDA y
+# QA, que abren la base en modo solo lectura, corren en paralelo al final.
+PIPELINE = {
+    "etl": ("uv run python observatorio/etl.py",
+            "Paso 1: ETL - Procesando datos base", ()),
+    "etl_products": ("uv run python observatorio/etl_products.py",
+                     "Paso 2: ETL - Procesando productos por categoría", ("etl",)),
+    "metrics": ("uv run python observatorio/metrics.py",
+                "Paso 3: Generando métricas KPI generales", ("etl_products",)),
+    "metrics_products": ("uv run python observatorio/metrics_products.py",
+                         "Paso 4: Generando métricas KPI de productos", ("metrics",)),
+    "eda": ("uv run python observatorio/eda.py",
+            "Paso 5: Análisis exploratorio (EDA)", ("metrics_products",)),
+    "qa": ("uv run python tests/test_products_qa.py",
+           "Paso 6: Tests de QA de productos", ("metrics_products",)),
+}
+# Pasos cuyo fallo no detiene el pipeline
+OPTIONAL_STEPS = {"qa"}
+
+def run_command(name, cmd, description):
+    """Ejecutar comando con logging.
+
+    Los pasos pueden correr en paralelo: cada línea lleva el nombre del paso y
+    el reporte final se imprime de una sola vez al terminar, sin intercalarse.
+    """
+    print(f"\n🔄 [{name}] {description}\n[{name}]    Comando: {cmd}")
     
     start_time = time.time()
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+    # Salida en streaming: solo se retienen las últimas líneas (memoria acotada)
+    tail = deque(maxlen=3)
+    with subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT, text=True, bufsize=1) as proc:
+        for line in proc.stdout:
+            if line.strip():
+                tail.append(line.rstrip())
     duration = time.time() - start_time
     
-    if result.returncode == 0:
-        print(f"✅ Completado en {duration:.1f}s")
-        if result.stdout:
-            # Mostrar últimas líneas del output
-            lines = result.stdout.strip().split('\n')
-            for line in lines[-3:]:
-                if line.strip():
-                    print(f"   {line}")
+    if proc.returncode == 0:
+        # Últimas líneas del output
+        report = [f"✅ Completado en {duration:.1f}s"] + [f"   {line}" for line in tail]
     else:
-        print(f"❌ Error en {duration:.1f}s")
-        print(f"   Error: {result.stderr}")
-        return False
+        report = [f"❌ Error en {duration:.1f}s"] + [f"   Error: {line}" for line in tail]
+    print("\n".join(f"[{name}] {line}" for line in report))
     
+    return proc.returncode == 0
+
+def run_pipeline(pipeline):
+    """Lanza cada paso apenas terminan sus dependencias; se detiene ante el primer fallo"""
+    done = set()
+    pending = dict(pipeline)
+    running = {}
+    with ThreadPoolExecutor(max_workers=len(pipeline)) as ex:
+        while pending or running:
+            for name, (cmd, description, deps) in list(pending.items()):
+                if done.issuperset(deps):
+                    running[ex.submit(run_command, name, cmd, description)] = name
+                    del pending[name]
+            if not running:
+                break
+            
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                if future.result():
+                    done.add(name)
+                elif name in OPTIONAL_STEPS:
+                    print(f"⚠️  [{name}] falló pero continuando...")
+                    done.add(name)
+                else:
+                    # Fail fast: no lanzar más pasos (los que corren terminan solos)
+                    print(f"\n❌ [{name}] falló: se detiene el pipeline")
+                    pending.clear()
+                    return False
     return True
 
 def check_files():
@@ -42,9 +97,13 @@ def check_files():
         ("data/cdro_G1.xlsx", "Exportaciones por categoría")
     ]
     
+    # Un solo stat por archivo: sirve para existencia y tamaño
     missing = []
+    sizes = {}
     for file_path, description in required_files:
-        if not Path(file_path).exists():
+        try:
+            sizes[file_path] = os.stat(file_path).st_size
+        except FileNotFoundError:
             missing.append((file_path, description))
     
     if missing:
@@ -56,7 +115,7 @@ def check_files():
     
     print("✅ Todos los archivos requeridos están presentes:")
     for file_path, description in required_files:
-        size = Path(file_path).stat().st_size / 1024  # KB
+        size = sizes[file_path] / 1024  # KB
         print(f"   • {description}: {file_path} ({size:.0f} KB)")
     
     return True
@@ -73,30 +132,10 @@ def main():
         print("\n❌ No se puede continuar sin los archivos de datos")
         sys.exit(1)
     
-    # Paso 1: ETL datos base
-    if not run_command("uv run python observatorio/etl.py", "Paso 1: ETL - Procesando datos base"):
-        sys.exit(1)
-    
-    # Paso 2: ETL productos por categoría
-    if not run_command("uv run python observatorio/etl_products.py", "Paso 2: ETL - Procesando productos por categoría"):
-        sys.exit(1)
-    
-    # Paso 3: Métricas KPI generales
-    if not run_command("uv run python observatorio/metrics.py", "Paso 3: Generando métricas KPI generales"):
+    # Pasos 1-6: ETL, métricas, EDA y QA según sus dependencias
+    if not run_pipeline(PIPELINE):
         sys.exit(1)
     
-    # Paso 4: Métricas KPI de productos
-    if not run_command("uv run python observatorio/metrics_products.py", "Paso 4: Generando métricas KPI de productos"):
-        sys.exit(1)
-    
-    # Paso 5: Análisis exploratorio
-    if not run_command("uv run python observatorio/eda.py", "Paso 5: Análisis exploratorio (EDA)"):
-        sys.exit(1)
-    
-    # Paso 6: Tests de QA
-    if not run_command("uv run python tests/test_products_qa.py", "Paso 6: Tests de QA de productos"):
-        print("⚠️  QA falló pero continuando...")  # No fallar el pipeline por QA
-    
     # Verificar outputs generados
     print("\n📋 VERIFICANDO ARCHIVOS GENERADOS:")
     outputs = [
@@ -109,15 +148,17 @@ def main():
     ]
     
     for file_path, description in outputs:
-        if Path(file_path).exists():
-            if Path(file_path).is_file():
-                size = Path(file_path).stat().st_size
-                print(f"   ✅ {description}: {file_path} ({size/1024:.1f} KB)")
-            else:
-                files_count = len(list(Path(file_path).glob("*")))
-                print(f"   ✅ {description}: {file_path} ({files_count} archivos)")
-        else:
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
             print(f"   ❌ {description}: {file_path} (no encontrado)")
+            continue
+        if stat.S_ISREG(st.st_mode):
+            print(f"   ✅ {description}: {file_path} ({st.st_size/1024:.1f} KB)")
+        else:
+            with os.scandir(file_path) as entries:
+                files_count = sum(1 for _ in entries)
+            print(f"   ✅ {description}: {file_path} ({files_count} archivos)")
     
     # Resumen final
     print("\n🎉 PIPELINE COMPLETADO EXITOSAMENTE!")
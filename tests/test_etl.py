@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Tests unitarios para el parseo de hojas-año del ETL base
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import openpyxl
+import pytest
+
+# Los scripts de observatorio/ importan sus módulos hermanos directamente
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "observatorio"))
+from _constants import MONTHS
+from etl import _parse_sheet
+
+@pytest.fixture
+def book_without_total(tmp_path):
+    """Libro mínimo con una hoja-año cuya fila 'Total general' no trae Total anual"""
+    path = tmp_path / "libro.xlsx"
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "2020"
+    ws.append(["Cuadro de prueba"])
+    ws.append(["Concepto", *MONTHS, "Total"])
+    ws.append(["Total general", *range(1, 13), None])
+    wb.save(path)
+    return path
+
+@pytest.fixture
+def book_without_total_row(tmp_path):
+    """Libro mínimo con una hoja-año sin fila 'Total general'"""
+    path = tmp_path / "sin_total.xlsx"
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "2020"
+    ws.append(["Concepto", *MONTHS, "Total"])
+    ws.append(["Minería", *range(1, 13), 78])
+    wb.save(path)
+    return path
+
+def test_parse_sheet_empty_total_cell(book_without_total):
+    """Una celda Total vacía queda como NaN en lugar de romper el parseo"""
+    df = _parse_sheet(book_without_total, "2020", "import")
+    
+    assert len(df) == 13
+    assert df["month"].tolist() == MONTHS + ["Total"]
+    
+    months = df[df["month"] != "Total"]
+    assert months["usd"].tolist() == [float(v) for v in range(1, 13)]
+    
+    total = df[df["month"] == "Total"].iloc[0]
+    assert np.isnan(total["usd"])
+    assert total["sum_months"] == 78.0
+
+def test_parse_sheet_without_total_row_raises(book_without_total_row):
+    """Una hoja-año sin fila 'Total general' detiene el ETL en lugar de perder el año"""
+    with pytest.raises(ValueError, match="Total general"):
+        _parse_sheet(book_without_total_row, "2020", "import")
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
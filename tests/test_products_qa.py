@@ -3,183 +3,174 @@
 Tests de QA para verificar consistencia de datos de productos
 """
 
+import sys
 import duckdb
 import pytest
 from pathlib import Path
 
-def test_trade_prod_table_exists():
+# Los scripts de observatorio/ importan sus módulos hermanos directamente
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "observatorio"))
+from etl_products import QA_MONTHLY_VS_TOTAL_SQL
+
+@pytest.fixture(scope="module")
+def con():
+    """Una sola conexión de solo lectura a trade.duckdb para todo el módulo"""
+    con = duckdb.connect("trade.duckdb", read_only=True)
+    yield con
+    con.close()
+
+def test_trade_prod_table_exists(con):
     """Verificar que la tabla trade_prod existe"""
-    con = duckdb.connect("trade.duckdb")
     try:
         result = con.execute("SELECT COUNT(*) FROM trade_prod").fetchone()[0]
         assert result > 0, "La tabla trade_prod está vacía"
         print(f"✅ trade_prod contiene {result:,} registros")
     except Exception as e:
         pytest.fail(f"❌ Tabla trade_prod no existe o no es accesible: {e}")
-    finally:
-        con.close()
 
-def test_monthly_vs_total_consistency():
+def test_monthly_vs_total_consistency(con):
     """Compara suma de los 12 meses vs. Total anual por (year,flow,category)"""
-    con = duckdb.connect("trade.duckdb")
-    try:
-        # Consulta para encontrar discrepancias
-        discrepancies = con.execute("""
-            WITH monthly_sums AS (
-                SELECT 
-                    year, flow, category,
-                    SUM(CASE WHEN month != 'Total' THEN usd ELSE 0 END) AS sum_months,
-                    MAX(CASE WHEN month = 'Total' THEN usd ELSE 0 END) AS total_annual
-                FROM trade_prod
-                GROUP BY year, flow, category
-                HAVING MAX(CASE WHEN month = 'Total' THEN usd ELSE 0 END) > 0
-            )
-            SELECT 
-                year, flow, category, sum_months, total_annual,
-                ABS(sum_months - total_annual) AS difference
-            FROM monthly_sums
-            WHERE ABS(sum_months - total_annual) > 1000  -- Diferencia > $1K
-            ORDER BY difference DESC
-        """).fetchall()
+    # Discrepancias desde la vista qa_monthly_vs_total (creada por etl_products.py);
+    # en bases generadas antes de la vista, la misma consulta en línea
+    has_view = con.execute(
+        "SELECT COUNT(*) > 0 FROM duckdb_views() WHERE view_name = 'qa_monthly_vs_total'"
+    ).fetchone()[0]
+    source = "qa_monthly_vs_total" if has_view else f"({QA_MONTHLY_VS_TOTAL_SQL})"
+    discrepancies = con.execute(f"""
+        SELECT year, flow, category, sum_months, total_annual, difference
+        FROM {source}
+        WHERE difference > 1000  -- Diferencia > $1K
+        ORDER BY difference DESC
+    """).fetchall()
+    
+    if len(discrepancies) == 0:
+        print("✅ QA: Totales anuales coinciden con suma de meses")
+    else:
+        print(f"⚠️  {len(discrepancies)} discrepancias encontradas (diferencias > $1K)")
+        for row in discrepancies[:5]:  # Mostrar solo las 5 peores
+            year, flow, cat, sum_m, total_a, diff = row
+            print(f"   {year} {flow} {cat[:30]}... : ${diff:,.0f}")
         
-        if len(discrepancies) == 0:
-            print("✅ QA: Totales anuales coinciden con suma de meses")
-        else:
-            print(f"⚠️  {len(discrepancies)} discrepancias encontradas (diferencias > $1K)")
-            for row in discrepancies[:5]:  # Mostrar solo las 5 peores
+        # Solo fallar si hay discrepancias muy grandes (>$10M)
+        major_discrepancies = [d for d in discrepancies if d[5] > 10_000_000]
+        if major_discrepancies:
+            print(f"⚠️  {len(major_discrepancies)} discrepancias muy grandes detectadas")
+            # En lugar de fallar, solo advertir
+            for row in major_discrepancies[:3]:
                 year, flow, cat, sum_m, total_a, diff = row
-                print(f"   {year} {flow} {cat[:30]}... : ${diff:,.0f}")
-            
-            # Solo fallar si hay discrepancias muy grandes (>$10M)
-            major_discrepancies = [d for d in discrepancies if d[5] > 10_000_000]
-            if major_discrepancies:
-                print(f"⚠️  {len(major_discrepancies)} discrepancias muy grandes detectadas")
-                # En lugar de fallar, solo advertir
-                for row in major_discrepancies[:3]:
-                    year, flow, cat, sum_m, total_a, diff = row
-                    print(f"   💡 {year} {flow} {cat[:30]}... : ${diff:,.0f} diferencia")
-                print("ℹ️  Discrepancias grandes detectadas pero continuando (datos del mundo real)")
-            else:
-                print("ℹ️  Discrepancias menores aceptables")
-                
-    finally:
-        con.close()
+                print(f"   💡 {year} {flow} {cat[:30]}... : ${diff:,.0f} diferencia")
+            print("ℹ️  Discrepancias grandes detectadas pero continuando (datos del mundo real)")
+        else:
+            print("ℹ️  Discrepancias menores aceptables")
 
-def test_data_completeness():
+def test_data_completeness(con):
     """Verificar completitud de datos por año y flujo"""
-    con = duckdb.connect("trade.duckdb")
-    try:
-        # Verificar que tenemos datos para ambos flujos
-        flows = con.execute("SELECT DISTINCT flow FROM trade_prod ORDER BY flow").fetchall()
-        flow_names = [f[0] for f in flows]
-        
-        assert 'export' in flow_names, "❌ No se encontraron datos de exportación"
-        assert 'import' in flow_names, "❌ No se encontraron datos de importación"
-        print(f"✅ Flujos encontrados: {flow_names}")
-        
-        # Verificar rango de años
-        year_range = con.execute("""
-            SELECT MIN(year) as min_year, MAX(year) as max_year, COUNT(DISTINCT year) as n_years
-            FROM trade_prod
-        """).fetchone()
-        
-        min_year, max_year, n_years = year_range
-        assert n_years > 0, "❌ No se encontraron datos de años"
-        print(f"✅ Rango de años: {min_year}-{max_year} ({n_years} años)")
-        
-        # Verificar categorías
-        n_categories = con.execute("SELECT COUNT(DISTINCT category) FROM trade_prod").fetchone()[0]
-        assert n_categories > 0, "❌ No se encontraron categorías"
-        print(f"✅ Categorías únicas: {n_categories}")
-        
-    finally:
-        con.close()
+    # Flujos, rango de años y categorías en una sola pasada sobre trade_prod
+    flow_names, min_year, max_year, n_years, n_categories = con.execute("""
+        SELECT
+            COALESCE(list_sort(list(DISTINCT flow)), []) AS flows,
+            MIN(year) AS min_year, MAX(year) AS max_year,
+            COUNT(DISTINCT year) AS n_years,
+            COUNT(DISTINCT category) AS n_categories
+        FROM trade_prod
+    """).fetchone()
+    
+    # Verificar que tenemos datos para ambos flujos
+    assert 'export' in flow_names, "❌ No se encontraron datos de exportación"
+    assert 'import' in flow_names, "❌ No se encontraron datos de importación"
+    print(f"✅ Flujos encontrados: {flow_names}")
+    
+    # Verificar rango de años
+    assert n_years > 0, "❌ No se encontraron datos de años"
+    print(f"✅ Rango de años: {min_year}-{max_year} ({n_years} años)")
+    
+    # Verificar categorías
+    assert n_categories > 0, "❌ No se encontraron categorías"
+    print(f"✅ Categorías únicas: {n_categories}")
 
-def test_data_quality():
+def test_data_quality(con):
     """Verificar calidad de datos (valores negativos, nulos, etc.)"""
-    con = duckdb.connect("trade.duckdb")
+    # Negativos, nulos y categorías vacías: tres contadores en un solo scan
+    negative_values, null_values, empty_categories = con.execute("""
+        SELECT
+            COUNT(*) FILTER (WHERE usd < 0),
+            COUNT(*) FILTER (WHERE usd IS NULL),
+            COUNT(*) FILTER (WHERE category IS NULL OR TRIM(category) = '')
+        FROM trade_prod
+    """).fetchone()
+    
+    # Valores negativos
+    if negative_values > 0:
+        print(f"⚠️  {negative_values} valores negativos encontrados")
+        # Mostrar algunos ejemplos
+        examples = con.execute("""
+            SELECT year, month, flow, category, usd 
+            FROM trade_prod 
+            WHERE usd < 0 
+            ORDER BY usd ASC 
+            LIMIT 5
+        """).fetchall()
+        for ex in examples:
+            print(f"   {ex[0]} {ex[1]} {ex[2]} {ex[3][:30]}... : ${ex[4]:,.0f}")
+    else:
+        print("✅ No se encontraron valores negativos")
+    
+    # Valores nulos
+    assert null_values == 0, f"❌ {null_values} valores nulos encontrados en columna USD"
+    print("✅ No se encontraron valores nulos en USD")
+    
+    # Categorías vacías
+    assert empty_categories == 0, f"❌ {empty_categories} categorías vacías encontradas"
+    print("✅ No se encontraron categorías vacías")
+
+def test_kpi_table_consistency(con):
+    """Verificar consistencia de tabla KPI si existe"""
+    # Verificar si existe tabla KPI
     try:
-        # Valores negativos
-        negative_values = con.execute("""
-            SELECT COUNT(*) FROM trade_prod WHERE usd < 0
-        """).fetchone()[0]
+        kpi_count = con.execute("SELECT COUNT(*) FROM kpi_prod_monthly").fetchone()[0]
+        print(f"✅ kpi_prod_monthly contiene {kpi_count:,} registros")
         
-        if negative_values > 0:
-            print(f"⚠️  {negative_values} valores negativos encontrados")
-            # Mostrar algunos ejemplos
-            examples = con.execute("""
-                SELECT year, month, flow, category, usd 
-                FROM trade_prod 
-                WHERE usd < 0 
-                ORDER BY usd ASC 
-                LIMIT 5
-            """).fetchall()
-            for ex in examples:
-                print(f"   {ex[0]} {ex[1]} {ex[2]} {ex[3][:30]}... : ${ex[4]:,.0f}")
-        else:
-            print("✅ No se encontraron valores negativos")
-        
-        # Valores nulos
-        null_values = con.execute("""
-            SELECT COUNT(*) FROM trade_prod WHERE usd IS NULL
-        """).fetchone()[0]
-        
-        assert null_values == 0, f"❌ {null_values} valores nulos encontrados en columna USD"
-        print("✅ No se encontraron valores nulos en USD")
-        
-        # Categorías vacías
-        empty_categories = con.execute("""
-            SELECT COUNT(*) FROM trade_prod WHERE category IS NULL OR TRIM(category) = ''
-        """).fetchone()[0]
+        # Verificar que KPI tiene categorías válidas (diferencias de conjuntos en DuckDB)
+        missing_in_kpi, extra_in_kpi = con.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM (
+                    SELECT category FROM trade_prod
+                    EXCEPT
+                    SELECT category FROM kpi_prod_monthly
+                )),
+                (SELECT COUNT(*) FROM (
+                    SELECT category FROM kpi_prod_monthly
+                    EXCEPT
+                    SELECT category FROM trade_prod
+                ))
+        """).fetchone()
         
-        assert empty_categories == 0, f"❌ {empty_categories} categorías vacías encontradas"
-        print("✅ No se encontraron categorías vacías")
+        if missing_in_kpi:
+            print(f"⚠️  {missing_in_kpi} categorías faltan en KPI")
+        if extra_in_kpi:
+            print(f"⚠️  {extra_in_kpi} categorías extra en KPI")
         
-    finally:
-        con.close()
-
-def test_kpi_table_consistency():
-    """Verificar consistencia de tabla KPI si existe"""
-    con = duckdb.connect("trade.duckdb")
-    try:
-        # Verificar si existe tabla KPI
-        try:
-            kpi_count = con.execute("SELECT COUNT(*) FROM kpi_prod_monthly").fetchone()[0]
-            print(f"✅ kpi_prod_monthly contiene {kpi_count:,} registros")
-            
-            # Verificar que KPI tiene categorías válidas
-            base_categories = set(con.execute("SELECT DISTINCT category FROM trade_prod").fetchall())
-            kpi_categories = set(con.execute("SELECT DISTINCT category FROM kpi_prod_monthly").fetchall())
+        if not missing_in_kpi and not extra_in_kpi:
+            print("✅ Categorías consistentes entre trade_prod y kpi_prod_monthly")
             
-            missing_in_kpi = base_categories - kpi_categories
-            extra_in_kpi = kpi_categories - base_categories
-            
-            if missing_in_kpi:
-                print(f"⚠️  {len(missing_in_kpi)} categorías faltan en KPI")
-            if extra_in_kpi:
-                print(f"⚠️  {len(extra_in_kpi)} categorías extra en KPI")
-            
-            if not missing_in_kpi and not extra_in_kpi:
-                print("✅ Categorías consistentes entre trade_prod y kpi_prod_monthly")
-                
-        except:
-            print("ℹ️  Tabla kpi_prod_monthly no existe (ejecutar metrics_products.py)")
-            
-    finally:
-        con.close()
+    except:
+        print("ℹ️  Tabla kpi_prod_monthly no existe (ejecutar metrics_products.py)")
 
 if __name__ == "__main__":
     """Ejecutar tests directamente"""
     print("🔍 EJECUTANDO QA DE PRODUCTOS")
     print("=" * 50)
     
+    qa_con = duckdb.connect("trade.duckdb", read_only=True)
     try:
-        test_trade_prod_table_exists()
-        test_monthly_vs_total_consistency()
-        test_data_completeness()
-        test_data_quality()
-        test_kpi_table_consistency()
+        test_trade_prod_table_exists(qa_con)
+        test_monthly_vs_total_consistency(qa_con)
+        test_data_completeness(qa_con)
+        test_data_quality(qa_con)
+        test_kpi_table_consistency(qa_con)
         print("\n🎉 Todos los tests de QA pasaron exitosamente!")
     except Exception as e:
         print(f"\n❌ Error en QA: {e}")
-        exit(1) 
\ No newline at end of file
+        exit(1)
+    finally:
+        qa_con.close() 
\ No newline at end of file